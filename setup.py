@@ -1,7 +1,12 @@
+import pathlib
+import sys
+
 from setuptools import setup, find_packages
 
-with open("README.md", "r") as readme:
-    long_description = readme.read()
+if "sdist" in sys.argv or "bdist_wheel" in sys.argv:
+    long_description = pathlib.Path("README.md").read_text(encoding="utf-8")
+else:
+    long_description = ""
 
 
 setup(
@@ -26,11 +26,20 @@ extract metadata
 """
 
 
-import glob
+import hashlib
 import os
+import re
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import List, Optional, Dict
 
 import yaml
+try:
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
 
 from nsaph import ORIGINAL_FILE_COLUMN
 from nsaph_utils.utils.fwf import FWFColumn, FWFMeta
@@ -50,6 +59,60 @@ MEDICARE_KEY_COLUMNS = {
 }
 
 
+FWF_METADATA_KEYS = (
+    "Exact File Record Length (Bytes in Variable Block)",
+    "Exact File Size in Bytes with 512 Blocksize",
+    "Exact File Quantity (Rows)"
+)
+'''The only header metadata entries consumed by to_fwf_meta'''
+
+
+PRIMARY_KEY_COLUMNS = ("BENE_ID", "YEAR")
+'''Key columns included in the primary index for all medicare tables'''
+
+
+MBSF_AB_EXTRA_KEY_COLUMNS = ("STATE",)
+'''Key columns additionally included for mbsf_ab* tables'''
+
+
+SEPARATOR_RE = re.compile("^(?=---)(?=.*-{18})")
+'''Separator line between the FTS header and the columns section:
+starts with dashes and contains a run of at least 18 of them'''
+
+
+NAME_TO_KEY_COLUMN = {
+    name.upper(): key
+    for key, aliases in MEDICARE_KEY_COLUMNS.items()
+    for name in [key] + aliases
+}
+'''Reverse index: column name (or alias) => medicare key column'''
+
+
+def find_fts_files(root: str, prefix: str, suffix: str = ".fts") -> List[str]:
+    """
+    Recursively looks for files with the given name prefix and suffix
+
+    A faster replacement for glob.glob("**/{prefix}*{suffix}"): it
+    stays on the cheap DirEntry attributes instead of running an
+    fnmatch regex against every directory entry
+
+    :param root: directory to start from
+    :param prefix: file name prefix, e.g. "maxdata_ps_"
+    :param suffix: file name suffix, by default ".fts"
+    :return: list of paths to matching files at any depth
+    """
+
+    files = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                files.extend(find_fts_files(entry.path, prefix, suffix))
+            elif entry.name.startswith(prefix) \
+                    and entry.name.endswith(suffix):
+                files.append(entry.path)
+    return files
+
+
 def mcr_type(file_name: str) -> str:
     """
     Tries to guess medicare file type by its name
@@ -107,12 +170,31 @@ class ColumnReader:
             self.attributes.append(ColumnAttribute(c, c+l, f))
             c += l + 1
         self.attributes[-1].end = None
+        self._slices = tuple(
+            slice(a.start, a.end) for a in self.attributes
+        )
+        self._convs = tuple(a.conv for a in self.attributes)
 
     def read(self, line):
-        attrs = [a.arg(line) for a in self.attributes]
-        return self.constructor(*attrs)
+        return self.constructor(*[
+            conv(s) if s else None
+            for conv, sl in zip(self._convs, self._slices)
+            for s in (line[sl].strip(),)
+        ])
+
+    def read_all(self, lines) -> List:
+        """
+        Parses a block of column definition lines in one pass
+
+        :param lines: lines of the columns section of an FTS file
+        :return: list of column objects, one per line
+        """
+
+        read = self.read
+        return [read(line) for line in lines]
 
 
+@dataclass(init=False, eq=True)
 class FTSColumn:
     """
     Metadata object for a column described in FTS file
@@ -120,6 +202,19 @@ class FTSColumn:
     A column can be either a CSV or fixed width (fwf) column
     """
 
+    __slots__ = (
+        "order", "column", "type", "format", "width", "label", "is_input",
+        "_parsed", "_sql_type"
+    )
+
+    order: int
+    column: str
+    type: str
+    format: Optional[str]
+    width: Optional[float]
+    label: Optional[str]
+    is_input: bool
+
     @classmethod
     def conv(cls, i):
         """
@@ -144,24 +239,18 @@ class FTSColumn:
         self.width = c_width
         self.label = label
         self.is_input = True
-        self._attrs = [
-            attr for attr in self.__dict__ if attr[0] != '_'
-        ]
-
-    def __eq__(self, o: object) -> bool:
-        if not isinstance(o, FTSColumn):
-            return False
-        if o is self:
-            return True
-        for attr in self._attrs:
-            if getattr(self, attr) != getattr(o, attr):
-                return False
-        return True
+        self._parsed = None
+        self._sql_type = None
 
     def __str__(self) -> str:
         return "{:d}: {} [{}]".format(self.order, self.column, self.type)
 
     def analyze_format(self):
+        if self._parsed is None:
+            self._parsed = self._analyze_format()
+        return self._parsed
+
+    def _analyze_format(self):
         if self.format is not None:
             if self.format[0].isdigit():
                 fmt = self.format
@@ -175,7 +264,7 @@ class FTSColumn:
             else:
                 w = None
             if len(x) > 1 and x[1]:
-                scale = int(x(1))
+                scale = int(x[1])
             else:
                 scale = None
         else:
@@ -193,6 +282,11 @@ class FTSColumn:
         :return: SQL type of the column
         """
 
+        if self._sql_type is None:
+            self._sql_type = self._to_sql_type()
+        return self._sql_type
+
+    def _to_sql_type(self):
         t = self.type.upper()
         if t in [PG_SERIAL_TYPE]:
             return t
@@ -235,7 +329,13 @@ class FTSColumn:
         )
 
 
+@dataclass(init=False, eq=True)
 class AliasColumn(FTSColumn):
+
+    __slots__ = ("target",)
+
+    target: str
+
     def __init__(self, alias: str, column: FTSColumn):
         super().__init__(column.order, alias,
                          column.type, column.format,
@@ -254,21 +354,57 @@ class AliasColumn(FTSColumn):
         return d
 
 
+@dataclass(init=False, eq=True)
 class MedicaidFTSColumn(FTSColumn):
     """
     Subclass for a column in medicaid files
     """
 
+    __slots__ = ()
+
     nattrs = 6
 
+    def _analyze_format(self):
+        # Specialized for medicaid FTS: the format is a SAS format
+        # string starting with either '$' or a digit
+        fmt = self.format
+        if fmt is None:
+            return super()._analyze_format()
+        if fmt[0].isdigit():
+            can_be_numeric = True
+        else:
+            fmt = fmt[1:]
+            can_be_numeric = False
+        x = fmt.split('.')
+        w = int(x[0]) if x[0].isdigit() else None
+        scale = int(x[1]) if len(x) > 1 and x[1] else None
+        return can_be_numeric, scale, w
+
 
+@dataclass(init=False, eq=True)
 class MedicareFTSColumn(FTSColumn):
     """
     Subclass for a column in medicare files
     """
 
+    __slots__ = ("long_name", "start", "end")
+
+    long_name: str
+    start: int
+    end: int
+
     nattrs = 7
 
+    def _analyze_format(self):
+        # Specialized for medicare FTS: there is no format string and
+        # the width always arrives as a number
+        w = int(self.width)
+        if w != self.width:
+            scale = int(str(self.width).split('.')[1])
+        else:
+            scale = None
+        return True, scale, w
+
     @classmethod
     def conv(cls, i):
         if i in [0, 4]:
@@ -319,45 +455,86 @@ class CMSFTS:
         self.columns: List[FTSColumn] = []
         self.pk = None
         self.constructor = None
-        self.pattern = None
+        self.prefix = None
         self.metadata = dict()
+        self._column_dicts = dict()
         return
 
     def init(self, path: str):
         pass
 
-    def read_file(self, f):
-        with fopen(f, "rt") as fts:
-            lines = [line for line in fts]
-        i = 0
+    def list_files(self, root_dir: str = None) -> Optional[List[str]]:
+        """
+        Lists FTS files that would be parsed by :func:`init`
+
+        :param root_dir: directory containing FTS files
+        :return: list of paths or None if the files cannot be
+            determined without parsing
+        """
+
+        if self.prefix is None:
+            return None
+        root = root_dir if root_dir else "."
+        if not os.path.isdir(root):
+            return None
+        return find_fts_files(root, self.prefix)
+
+    def parse_file(self, f) -> List[FTSColumn]:
+        """
+        Parses a single FTS file
+
+        :param f: path to the FTS file
+        :return: list of columns described in the file
+        """
+
         column_reader = None
-        for i in range(0, len(lines)):
-            line = lines[i]
-            if line.startswith('---') and '------------------' in line:
-                column_reader = ColumnReader(self.constructor, line)
-                break
-            if ':' in line:
-                x = line.split(':', 1)
-                self.metadata[x[0].strip()] = x[1].strip()
-            continue
-
-        if 1 > i or i > len(lines) - 2:
+        column_lines = []
+        with fopen(f, "rt") as fts:
+            for line in fts:
+                if column_reader is None:
+                    # Header: metadata until the separator line
+                    if SEPARATOR_RE.match(line):
+                        column_reader = ColumnReader(self.constructor, line)
+                    else:
+                        stripped = line.lstrip()
+                        for key in FWF_METADATA_KEYS:
+                            if stripped.startswith(key):
+                                self.metadata[key] = \
+                                    stripped[len(key) + 1:].strip()
+                                break
+                    continue
+                # Columns section: until a terminator line.
+                # Dispatch on the first character, so that ordinary
+                # column lines take a single branch
+                c = line[:1]
+                if c == '-':
+                    if "End" in line:
+                        break
+                elif c == 'N':
+                    if line.startswith("Note:"):
+                        break
+                elif not line.strip():
+                    break
+                column_lines.append(line)
+
+        if column_reader is None or not column_lines:
             raise Exception("Column definitions are not found in {}".format(f))
 
-        columns = []
-        while i < len(lines):
-            i += 1
-            line = lines[i]
-            if not line.strip():
-                break
-            if line.startswith("Note:"):
-                break
-            if line.startswith("-") and "End" in line:
-                break
-            column = column_reader.read(line)
-            columns.append(column)
+        columns = column_reader.read_all(column_lines)
 
         self.on_after_read_file(columns)
+        return columns
+
+    def reconcile(self, f, columns: List[FTSColumn]):
+        """
+        Verifies that columns parsed from an FTS file are identical
+        to the columns seen so far
+
+        :param f: path to the FTS file, used for error reporting
+        :param columns: columns parsed from the file
+        :return: nothing
+        """
+
         if not self.columns:
             self.columns = columns
             return
@@ -369,6 +546,9 @@ class CMSFTS:
             if columns[i] != self.columns[i]:
                 raise Exception("Reconciliation required: {}, column: {}".format(f, columns[i]))
 
+    def read_file(self, f):
+        self.reconcile(f, self.parse_file(f))
+
     def on_after_read_file(self, columns: List[FTSColumn]):
         """
         Callback function
@@ -427,7 +607,11 @@ class CMSFTS:
         :return: dictionary
         """
 
-        d = c.to_dict()
+        base = self._column_dicts.get(id(c))
+        if base is None:
+            base = c.to_dict()
+            self._column_dicts[id(c)] = base
+        d = dict(base)
         if c.column in self.indices:
             d["index"] = True
         if c.column == ORIGINAL_FILE_COLUMN:
@@ -504,10 +688,52 @@ class CMSFTS:
             columns=columns
         )
 
+    def cache_key(self, root_dir: str = None) -> Optional[str]:
+        """
+        Computes a cache key for the YAML model produced by this
+        instance. The key depends on the paths and modification
+        times of the FTS files that would be parsed, hence it is
+        invalidated whenever any of them changes.
+
+        :param root_dir: directory containing FTS files
+        :return: hexadecimal digest or None if the source files
+            cannot be determined
+        """
+
+        files = self.list_files(root_dir)
+        if not files:
+            return None
+        signature = ":".join(sorted(
+            "{}:{}".format(f, os.path.getmtime(f)) for f in files
+        ))
+        return hashlib.blake2b(signature.encode()).hexdigest()
+
+    @staticmethod
+    def cache_path(key: str) -> str:
+        cache_home = os.environ.get(
+            "XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))
+        )
+        return os.path.join(cache_home, "nsaph-cms", "fts", key + ".yaml")
+
     def print_yaml(self, root_dir: str = None):
+        key = self.cache_key(root_dir)
+        cache = self.cache_path(key) if key else None
+        if cache and os.path.isfile(cache):
+            with open(cache, "rt") as f:
+                shutil.copyfileobj(f, sys.stdout)
+            return
         self.init(root_dir)
         table = self.to_dict()
-        print(yaml.dump(table))
+        if cache:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            tmp = "{}.{:d}.tmp".format(cache, os.getpid())
+            with open(tmp, "wt") as f:
+                yaml.dump(table, f, Dumper=YamlDumper, sort_keys=False)
+            os.replace(tmp, cache)
+            with open(cache, "rt") as f:
+                shutil.copyfileobj(f, sys.stdout)
+        else:
+            yaml.dump(table, sys.stdout, Dumper=YamlDumper, sort_keys=False)
 
 
 class MedicaidFTS(CMSFTS):
@@ -526,7 +752,7 @@ class MedicaidFTS(CMSFTS):
         super().__init__(type_of_data)
         self.constructor = MedicaidFTSColumn
         assert self.table_type in ["ps", "ip"]
-        self.pattern = "**/maxdata_{}_*.fts".format(type_of_data)
+        self.prefix = "maxdata_{}_".format(type_of_data)
         self.indices += self.medicaid_indices
         if self.table_type == "ps":
             year_column = "MAX_YR_DT"
@@ -539,13 +765,13 @@ class MedicaidFTS(CMSFTS):
             self.indices += ["MSIS_ID", "STATE_CD", year_column, "RECORD"]
 
     def init(self, path: str = None):
-        if path is not None:
-            pattern = os.path.join(path, self.pattern)
-        else:
-            pattern = self.pattern
-        files = glob.glob(pattern)
-        for file in files:
-            self.read_file(file)
+        files = self.list_files(path)
+        if not files:
+            return self
+        with ThreadPoolExecutor(max_workers=min(32, len(files))) as executor:
+            results = executor.map(self.parse_file, files)
+            for file, columns in zip(files, results):
+                self.reconcile(file, columns)
         return self
 
     def on_after_read_file(self, columns: List[FTSColumn]):
@@ -563,7 +789,7 @@ class MedicareFTS(CMSFTS):
         super().__init__(type_of_data)
         self.constructor = MedicareFTSColumn
         assert self.table_type in MEDICARE_FILE_TYPES
-        self.pattern = "**/{}_*.fts".format(type_of_data)
+        self.prefix = "{}_".format(type_of_data)
         self.key_columns: Dict[str, Optional[FTSColumn]] = {
             key: None for key in MEDICARE_KEY_COLUMNS
         }
@@ -584,15 +810,14 @@ class MedicareFTS(CMSFTS):
 
     def check_key_columns(self, columns: List[FTSColumn]):
         for column in columns:
-            for key in MEDICARE_KEY_COLUMNS:
-                candidates = [key] + MEDICARE_KEY_COLUMNS[key]
-                if column.column.upper() in candidates:
-                    if self.key_columns[key] is not None:
-                        raise ValueError(
-                            "Duplicate column candidate for " + key
-                        )
-                    self.key_columns[key] = column
-        for key in ["BENE_ID", "YEAR"]:
+            key = NAME_TO_KEY_COLUMN.get(column.column.upper())
+            if key is not None:
+                if self.key_columns[key] is not None:
+                    raise ValueError(
+                        "Duplicate column candidate for " + key
+                    )
+                self.key_columns[key] = column
+        for key in PRIMARY_KEY_COLUMNS:
             if self.key_columns[key] is None:
                 raise ValueError("Missing {} column for {}".format(
                     key,  self.table_type
@@ -606,19 +831,21 @@ class MedicareFTS(CMSFTS):
         return
 
     def add_indices(self, columns: List[FTSColumn]):
+        is_mbsf_ab = self.table_type.startswith("mbsf_ab")
         p_idx_columns = []
+        aliases = []
         for key in MEDICARE_KEY_COLUMNS:
             c = self.key_columns[key]
             if c is None:
                 continue
-            if key in ["BENE_ID", "YEAR"]:
-                p_idx_columns.append(key)
-            elif self.table_type.startswith("mbsf_ab") and key in ["STATE"]:
+            if key in PRIMARY_KEY_COLUMNS \
+                    or (is_mbsf_ab and key in MBSF_AB_EXTRA_KEY_COLUMNS):
                 p_idx_columns.append(key)
             if c.column.upper() == key:
                 self.indices.append(key)
-            elif c is not None:
-                columns.append(AliasColumn(key, c))
+            else:
+                aliases.append(AliasColumn(key, c))
+        columns.extend(aliases)
         self.indices.append({"primary": {"columns": p_idx_columns}})
 
 
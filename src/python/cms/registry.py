@@ -44,6 +44,10 @@ from pathlib import Path
 from typing import Dict
 
 import yaml
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
 
 from cms.create_schema_config import CMSSchema
 from cms.fts2yaml import MedicaidFTS, MedicareFTS, mcr_type
@@ -74,7 +78,7 @@ class Registry:
 
         if (not self.context.reset) and os.path.isfile(registry_path):
             with open(registry_path) as f:
-                self.registry = yaml.safe_load(f)
+                self.registry = yaml.load(f, Loader=YamlLoader)
         else:
             self.init()
         if self.context.type == "medicaid":
@@ -85,7 +89,7 @@ class Registry:
             raise ValueError("Unknown data type: " + self.context.type)
 
         with open(registry_path, "wt") as f:
-            f.write(yaml.dump(self.registry))
+            f.write(yaml.dump(self.registry, Dumper=YamlDumper))
         return
 
     def init(self):
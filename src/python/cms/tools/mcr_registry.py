@@ -23,6 +23,10 @@ Common content for the Medicare data model YAML file
 
 import os
 import yaml
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
 
 
 class MedicareRegistry:
@@ -52,11 +56,11 @@ class MedicareRegistry:
 
     def read_registry(self):
         with open(self.registry_path) as f:
-            self.registry = yaml.safe_load(f)
+            self.registry = yaml.load(f, Loader=YamlLoader)
         return
 
     def save(self):
         with open(self.registry_path, "wt") as f:
-            yaml.dump(self.registry, f)
+            yaml.dump(self.registry, f, Dumper=YamlDumper)
         return
 
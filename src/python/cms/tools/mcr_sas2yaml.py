@@ -29,6 +29,10 @@ import re
 import sys
 from typing import List
 import yaml
+try:
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
 
 from cms.tools.mcr_registry import MedicareRegistry
 from cms.tools.mcr_sas import MedicareSAS
@@ -51,7 +55,7 @@ class SASIntrospector(MedicareSAS, MedicareRegistry):
         introspector = SASIntrospector(registry_path, root_dir)
         introspector.traverse(pattern)
         introspector.save()
-        yaml.dump(introspector.registry, sys.stdout)
+        yaml.dump(introspector.registry, sys.stdout, Dumper=YamlDumper)
         return
 
     def __init__(self, registry_path: str, root_dir: str = '.'):